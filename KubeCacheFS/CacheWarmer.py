@@ -0,0 +1,200 @@
+import json
+import logging
+import math
+import os
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class CacheWarmer:
+    """ CacheWarmer loads pages into KubeCache in the background without getting in the way of foreground I/O """
+
+    def __init__(self, kubecache, page_list, config):
+        self.kubecache = kubecache
+        self.page_queue = queue.Queue()
+        for path, page_index in page_list:
+            self.page_queue.put((path, page_index))
+
+        # the caches the pages are warmed into, threads stop once all of them are full
+        self.cache_index_set = {kubecache.get_warm_cache_index(path) for path, _ in page_list}
+        self.cache_index_set.discard(None)
+
+        # bytes per second read from persistent storage by all the threads, None for no limit
+        self.bandwidth = config["bandwidth_mb"]*1024*1024 if "bandwidth_mb" in config else None
+        self.concurrency = config["concurrency"] if "concurrency" in config else 1
+
+        # seconds without foreground I/O before a thread loads its next page
+        self.idle_time = config["idle_ms"]/1000 if "idle_ms" in config else 0.01
+
+        self.stop_event = threading.Event()
+        self.thread_list = []
+        self.bandwidth_lock = threading.Lock()
+        self.next_read_time = 0.0
+
+        self.pages_warmed = 0
+        self.bytes_warmed = 0
+
+    @staticmethod
+    def _full_path(root, partial):
+        if partial.startswith("/"):
+            partial = partial[1:]
+        return os.path.join(root, partial)
+
+    @staticmethod
+    def get_page_list_from_manifest(manifest, root, page_size):
+        """ Get the pages to warm from a manifest. The manifest has a list of "files",
+            each with a "path" and optionally an "offset" and "length", and a list of
+            "pages", each with a "path" and a "page_index". Paths are relative to the
+            mountpoint.
+
+            :param manifest: the manifest loaded from the warm file
+            :param root: the directory used as persistent storage
+            :param page_size: the page size of KubeCache
+
+            :return page_list: a list of (path, page_index) tuples in the order they should be warmed """
+
+        page_list = []
+        for file_entry in manifest["files"] if "files" in manifest else []:
+            full_path = CacheWarmer._full_path(root, file_entry["path"])
+            if not os.path.isfile(full_path):
+                continue
+
+            offset = file_entry["offset"] if "offset" in file_entry else 0
+            length = file_entry["length"] if "length" in file_entry else os.path.getsize(full_path)-offset
+            if length <= 0:
+                continue
+
+            start_page = math.floor(offset/page_size)
+            end_page = math.floor((offset+length-1)/page_size)
+            for page_index in range(start_page, end_page+1):
+                page_list.append((full_path, page_index))
+
+        for page_entry in manifest["pages"] if "pages" in manifest else []:
+            page_list.append((CacheWarmer._full_path(root, page_entry["path"]), page_entry["page_index"]))
+        return page_list
+
+    @staticmethod
+    def get_manifest_from_hot_pages(hot_page_list, root):
+        """ Get a manifest that warms the pages exported by KubeCache.export_hot_pages.
+
+            :param hot_page_list: a list of (path, page_index) tuples
+            :param root: the directory used as persistent storage
+
+            :return manifest: a manifest with a list of "pages" """
+
+        return {"pages": [{"path": os.path.relpath(path, root), "page_index": page_index}
+            for path, page_index in hot_page_list]}
+
+    @staticmethod
+    def load_manifest(manifest_file):
+        """ Load a manifest from a file.
+
+            :param manifest_file: the path of the manifest
+
+            :return manifest: the manifest or None if the file is missing or not valid JSON """
+
+        try:
+            with open(manifest_file) as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("Not warming the cache, cannot load manifest %s: %s", manifest_file, e)
+            return None
+
+    @staticmethod
+    def save_manifest(manifest, manifest_file):
+        """ Save a manifest to a file, replacing it atomically so that a reader never
+            sees a partially written manifest.
+
+            :param manifest: the manifest to save
+            :param manifest_file: the path of the manifest
+
+            :return None """
+
+        tmp_manifest_file = "{}.tmp".format(manifest_file)
+        with open(tmp_manifest_file, "w+") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_manifest_file, manifest_file)
+
+    def start(self):
+        """ Start the warming threads.
+
+            :return None """
+
+        for _ in range(self.concurrency):
+            thread = threading.Thread(target=self._run, daemon=True)
+            thread.start()
+            self.thread_list.append(thread)
+
+    def stop(self):
+        """ Stop warming and wait for the threads to finish the page they are loading.
+
+            :return None """
+
+        self.stop_event.set()
+        self.join()
+
+    def join(self):
+        """ Wait until every page has been warmed or warming has been stopped.
+
+            :return None """
+
+        for thread in self.thread_list:
+            thread.join()
+
+    def _wait_for_idle(self):
+        """ Block while foreground I/O is active.
+
+            :return None """
+
+        while not self.stop_event.is_set() and self.kubecache.is_foreground_busy(self.idle_time):
+            self.stop_event.wait(self.idle_time)
+
+    def _throttle(self, num_bytes):
+        """ Charge num_bytes read from storage and block until the threads are back 
+            under the bandwidth limit.
+
+            :param num_bytes: the number of bytes that were read
+
+            :return None """
+
+        if self.bandwidth is None or num_bytes == 0:
+            return
+
+        with self.bandwidth_lock:
+            cur_time = time.monotonic()
+            self.next_read_time = max(cur_time, self.next_read_time) + num_bytes/self.bandwidth
+            read_time = self.next_read_time
+
+        self.stop_event.wait(read_time-cur_time)
+
+    def _are_caches_full(self):
+        return all(self.kubecache.is_cache_full(cache_index) for cache_index in self.cache_index_set)
+
+    def _run(self):
+        while not self.stop_event.is_set() and not self._are_caches_full():
+            try:
+                path, page_index = self.page_queue.get_nowait()
+            except queue.Empty:
+                return
+
+            # skip pages that would not be loaded without waiting or reading them
+            if not self.kubecache.can_warm_page(path, page_index):
+                continue
+
+            self._wait_for_idle()
+            if self.stop_event.is_set():
+                return
+
+            try:
+                bytes_read, bytes_warmed = self.kubecache.warm_page(path, page_index)
+            except OSError:
+                # the file may have been removed or renamed since the manifest was written
+                continue
+            self._throttle(bytes_read)
+
+            if bytes_warmed:
+                with self.bandwidth_lock:
+                    self.pages_warmed += 1
+                    self.bytes_warmed += bytes_warmed
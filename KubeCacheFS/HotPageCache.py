@@ -0,0 +1,108 @@
+from collections import OrderedDict
+
+class HotPageCache:
+    """ HotPageCache keeps the hottest pages of KubeCache in a fixed pool of in-process buffers """
+
+    def __init__(self, num_pages, page_size):
+        self.num_pages = num_pages
+        self.page_size = page_size
+
+        # one bytearray split into page sized slots, allocated once
+        self.buffer = bytearray(num_pages*page_size)
+        self.buffer_view = memoryview(self.buffer)
+        self.page_len_list = [0]*num_pages
+        self.free_slot_list = list(range(num_pages))
+
+        # page_id -> slot index, kept in LRU order so lookup, update and eviction are O(1)
+        self.slot_dict = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, page_id):
+        """ Get the data of a page.
+
+            :param page_id: the id of the page
+
+            :return: a copy of the page data or None if the page is not cached """
+
+        slot = self.slot_dict.get(page_id)
+        if slot is None:
+            self.misses += 1
+            return None
+
+        self.slot_dict.move_to_end(page_id)
+        self.hits += 1
+        slot_offset = slot*self.page_size
+        return bytes(self.buffer_view[slot_offset:slot_offset+self.page_len_list[slot]])
+
+    def put(self, page_id, page_data):
+        """ Add a page, evicting the least recently used page if there is no free slot.
+
+            :param page_id: the id of the page
+            :param page_data: the data of the page, at most page_size bytes
+
+            :return None """
+
+        if self.num_pages == 0:
+            return
+
+        slot = self.slot_dict.get(page_id)
+        if slot is not None:
+            self.slot_dict.move_to_end(page_id)
+        elif self.free_slot_list:
+            slot = self.free_slot_list.pop()
+            self.slot_dict[page_id] = slot
+        else:
+            _, slot = self.slot_dict.popitem(last=False)
+            self.slot_dict[page_id] = slot
+
+        slot_offset = slot*self.page_size
+        self.buffer_view[slot_offset:slot_offset+len(page_data)] = page_data
+        self.page_len_list[slot] = len(page_data)
+
+    def update(self, page_id, page_offset, buf):
+        """ Overwrite part of a page if it is cached so that it stays coherent with writes.
+
+            :param page_id: the id of the page
+            :param page_offset: the offset in the page where the write begins
+            :param buf: the bytes written to the page
+
+            :return None """
+
+        slot = self.slot_dict.get(page_id)
+        if slot is None:
+            return
+
+        slot_offset = slot*self.page_size
+        page_len = self.page_len_list[slot]
+
+        # a write past the end of the page leaves a hole that reads back as zeros, the 
+        # slot may still hold data of the page that used it before 
+        if page_offset > page_len:
+            self.buffer_view[slot_offset+page_len:slot_offset+page_offset] = bytes(page_offset-page_len)
+
+        self.buffer_view[slot_offset+page_offset:slot_offset+page_offset+len(buf)] = buf
+        self.page_len_list[slot] = max(page_len, page_offset+len(buf))
+
+    def invalidate(self, page_id):
+        """ Remove a page.
+
+            :param page_id: the id of the page
+
+            :return None """
+
+        slot = self.slot_dict.pop(page_id, None)
+        if slot is not None:
+            self.free_slot_list.append(slot)
+
+    def hit_rate(self):
+        """ Get the hit rate of the lookups done so far.
+
+            :return: hits/(hits+misses) or 0.0 if there has been no lookup """
+
+        num_lookups = self.hits + self.misses
+        return self.hits/num_lookups if num_lookups else 0.0
+
+    def __len__(self):
+        return len(self.slot_dict)
@@ -3,16 +3,26 @@ import json
 import os 
 import math 
 import hashlib 
+import threading 
+import time 
 import numpy as np 
 
 from PyMimircache.cache.lru import LRU
 from PyMimircache.cacheReader.requestItem import Req
 
+from MemPressureMonitor import MemPressureMonitor
+from HotPageCache import HotPageCache
+
 class ReplacementPolicy(Enum):
     LRU = 1
     LFU = 2
     MRU = 3
 
+class WritePolicy(Enum):
+    WRITE_BACK = "write-back"
+    WRITE_THROUGH = "write-through"
+    WRITE_AROUND = "write-around"
+
 class KubeCache:
     """ KubeCache handles caching for KubeCacheFS """
 
@@ -22,6 +32,39 @@ class KubeCache:
         self.ignore_dir_list = config["ignore_dir"] if "ignore_dir" in config else []
         self.cache_config_list = config["caches"]
         self.cache_list = KubeCache._get_cache_list_from_config(config)
+        self.write_policy_list = [WritePolicy(cache["write_policy"]) if "write_policy" in cache else WritePolicy.WRITE_BACK 
+            for cache in self.cache_config_list]
+
+        # hits, misses and write-backs of all the caches with the same write policy 
+        self.stats = {write_policy.value: {
+            "read_hits": 0,
+            "read_misses": 0,
+            "write_hits": 0,
+            "write_misses": 0,
+            "writebacks": 0
+        } for write_policy in WritePolicy}
+
+        # the number of pages each cache can hold right now, lowered under memory pressure 
+        self.cache_capacity_list = [cache["size"] for cache in self.cache_config_list]
+        self.mem_monitor = MemPressureMonitor(config["mem_pressure"]) if "mem_pressure" in config else None
+
+        # in-process buffers for the hottest pages, every page in it is also in one of the caches 
+        self.hot_cache = HotPageCache(config["hot_cache_size"], self.page_size) if "hot_cache_size" in config else None
+
+        # foreground I/O and background warming share the caches, warming backs off while 
+        # foreground requests are in flight or were seen recently 
+        self.lock = threading.RLock()
+        self.num_foreground_ops = 0 
+        self.last_foreground_time = 0.0
+
+        # bumped on every write that can reach storage so that a page read for warming 
+        # without the lock is dropped if storage might have changed under it 
+        self.storage_write_count = 0 
+
+        # the memory pressure monitor also runs on its own thread once started so that 
+        # the caches shrink even when there is no I/O 
+        self.mem_monitor_thread = None 
+        self.mem_monitor_stop_event = threading.Event()
 
     @staticmethod
     def _get_cache_list_from_config(config):
@@ -32,6 +75,29 @@ class KubeCache:
                 cache_list.append(LRU(cache["size"]))
         return cache_list 
 
+    def _get_cache_index(self, path):
+        """ Get the index of the cache that handles a path 
+
+            :param path: the path of the file being accessed 
+
+            :return cache_index: the index of the cache or None if the path is not cached """
+
+        cache_index = None 
+        for cur_cache_index, cache in enumerate(self.cache_config_list):
+            if cache["dir"] == "*" and cache_index is None:
+                cache_index = cur_cache_index
+            elif cache["dir"] in path:
+                cache_index = cur_cache_index
+        return cache_index
+
+    def _record(self, cache_index, stat):
+        """ Count an event against the write policy of a cache 
+
+            :param cache_index: the index of the cache 
+            :param stat: the name of the counter """
+
+        self.stats[self.write_policy_list[cache_index].value][stat] += 1
+
     def _get_pages(self, offset, length):
         """ Get all the relevant pages for a file at an offset and length 
 
@@ -90,6 +156,7 @@ class KubeCache:
 
             :return None """
 
+        self.storage_write_count += 1
         page_data = self._read_page(os.path.join(self.cache_dir, cache_req.item_id))
         fh = os.open(cache_req.path, os.O_WRONLY)
         page_index = int(cache_req.item_id.split("_")[1])
@@ -107,11 +174,227 @@ class KubeCache:
 
         if evicted_req.op == 1:
             self._flush_page(evicted_req)
+            self._record(cache_index, "writebacks")
         os.remove(os.path.join(self.cache_dir, evicted_id))
+        if self.hot_cache is not None:
+            self.hot_cache.invalidate(evicted_id)
+
+    def _invalidate_page(self, cache_index, page_id):
+        """ Remove a page from cache, writing it back first if it is dirty. 
+
+            :param cache_index: the index of the cache holding the page 
+            :param page_id: the id of the page 
+
+            :return None """
+        cache_req = self.cache_list[cache_index].cacheline_dict.pop(page_id)
+
+        if cache_req.op == 1:
+            self._flush_page(cache_req)
+            self._record(cache_index, "writebacks")
+        os.remove(os.path.join(self.cache_dir, page_id))
+        if self.hot_cache is not None:
+            self.hot_cache.invalidate(page_id)
+
+    def _shrink_cache(self, cache_index, capacity):
+        """ Evict pages from a cache until it fits in the capacity. Clean pages are 
+            dropped first, dirty pages are evicted only after they are written back. 
+
+            :param cache_index: the index of the cache to be shrunk 
+            :param capacity: the number of pages the cache can hold 
+
+            :return None """
+        cache = self.cache_list[cache_index]
+        num_excess_pages = len(cache) - capacity
+        if num_excess_pages <= 0:
+            return 
+
+        # cacheline_dict is in LRU order so the least recently used clean pages go first 
+        clean_page_id_list = [page_id for page_id, cache_req in cache.cacheline_dict.items() if cache_req.op == 0]
+        for page_id in clean_page_id_list[:num_excess_pages]:
+            self._invalidate_page(cache_index, page_id)
+
+        while len(cache) > capacity:
+            self._evict(cache_index)
+
+    def _check_mem_pressure(self):
+        """ Poll the memory pressure monitor and resize the caches. Under pressure each 
+            cache loses a step of its capacity, once the pressure clears the capacity 
+            grows back a step at a time up to the configured size. 
+
+            :return None """
+        if self.mem_monitor is None:
+            return 
+
+        under_pressure = self.mem_monitor.poll()
+        if under_pressure is None:
+            return 
+
+        for cache_index, cache in enumerate(self.cache_config_list):
+            capacity = self.cache_capacity_list[cache_index]
+            if under_pressure:
+                min_capacity = max(1, math.ceil(cache["size"]*self.mem_monitor.min_fraction))
+                capacity = max(min_capacity, capacity - math.ceil(capacity*self.mem_monitor.shrink_step))
+                self._shrink_cache(cache_index, capacity)
+            else:
+                capacity = min(cache["size"], capacity + math.ceil(cache["size"]*self.mem_monitor.grow_step))
+            self.cache_capacity_list[cache_index] = capacity
+
+    def _run_mem_monitor(self):
+        while not self.mem_monitor_stop_event.wait(self.mem_monitor.interval):
+            with self.lock:
+                self._check_mem_pressure()
+
+    def start_mem_monitor(self):
+        """ Start polling the memory pressure monitor every interval on a daemon thread. 
+            Until it is started the monitor is polled from read and write instead. 
+
+            :return None """
+        if self.mem_monitor is None or self.mem_monitor_thread is not None:
+            return 
+
+        self.mem_monitor_stop_event.clear()
+        self.mem_monitor_thread = threading.Thread(target=self._run_mem_monitor, daemon=True)
+        self.mem_monitor_thread.start()
+
+    def stop_mem_monitor(self):
+        """ Stop the thread started by start_mem_monitor. 
+
+            :return None """
+        if self.mem_monitor_thread is None:
+            return 
+
+        self.mem_monitor_stop_event.set()
+        self.mem_monitor_thread.join()
+        self.mem_monitor_thread = None 
+
+
+    def read(self, path, length, offset, fh):
+        self.num_foreground_ops += 1
+        try:
+            with self.lock:
+                return self._read(path, length, offset, fh)
+        finally:
+            self.num_foreground_ops -= 1
+            self.last_foreground_time = time.monotonic()
+
+    def write(self, path, buf, offset, fh):
+        self.num_foreground_ops += 1
+        try:
+            with self.lock:
+                return self._write(path, buf, offset, fh)
+        finally:
+            self.num_foreground_ops -= 1
+            self.last_foreground_time = time.monotonic()
+
+    def is_foreground_busy(self, idle_time):
+        """ Check if foreground I/O is running or finished less than idle_time seconds ago. 
+
+            :param idle_time: the seconds without foreground I/O after which it is idle 
+
+            :return: True if background work should wait """
+        return self.num_foreground_ops > 0 or time.monotonic()-self.last_foreground_time < idle_time
 
+    def get_warm_cache_index(self, path):
+        """ Get the index of the cache a path is warmed into. 
 
-    def read(self, path, length, offset, fh):      
+            :param path: the path of the file in persistent storage 
+
+            :return cache_index: the index of the cache or None if the path is ignored or not cached """
+        for ignore_dir in self.ignore_dir_list:
+            if ignore_dir in path:
+                return None 
+        return self._get_cache_index(path)
+
+    def is_cache_full(self, cache_index):
+        """ Check if a cache has no free capacity left. 
+
+            :param cache_index: the index of the cache 
+
+            :return: True if the cache holds as many pages as its capacity """
+        return len(self.cache_list[cache_index]) >= self.cache_capacity_list[cache_index]
+
+    def _get_warm_page_id(self, cache_index, path, page_index):
+        """ Get the id of a page to warm, must be called with the lock held. 
+
+            :param cache_index: the index of the cache handling the path 
+            :param path: the path of the file in persistent storage 
+            :param page_index: the index of the page 
+
+            :return page_id: the id of the page or None if it is cached or the cache is full """
+        page_id = self._get_page_id(path, page_index)
+        if page_id in self.cache_list[cache_index].cacheline_dict or self.is_cache_full(cache_index):
+            return None 
+        return page_id
+
+    def can_warm_page(self, path, page_index):
+        """ Check if warm_page would load a page right now. 
+
+            :param path: the path of the file in persistent storage 
+            :param page_index: the index of the page 
+
+            :return: True if the page is not cached and its cache has free capacity """
+        cache_index = self.get_warm_cache_index(path)
+        if cache_index is None:
+            return False 
+        with self.lock:
+            return self._get_warm_page_id(cache_index, path, page_index) is not None
+
+    def warm_page(self, path, page_index):
+        """ Load a page into its cache as a clean page. Pages already cached are skipped 
+            and nothing is evicted to make room, warming only fills free capacity. The 
+            page is read from storage without holding the lock so foreground I/O never 
+            waits on it, and it is dropped if foreground I/O cached it, filled the cache 
+            or wrote to storage in the meantime. 
+
+            :param path: the path of the file in persistent storage 
+            :param page_index: the index of the page 
+
+            :return: a tuple of the bytes read from storage and the bytes loaded into cache """
+        cache_index = self.get_warm_cache_index(path)
+        if cache_index is None:
+            return 0, 0
+
+        with self.lock:
+            if self._get_warm_page_id(cache_index, path, page_index) is None:
+                return 0, 0
+            storage_write_count = self.storage_write_count
+
+        file_fh = os.open(path, os.O_RDONLY)
+        os.lseek(file_fh, page_index*self.page_size, os.SEEK_SET)
+        page_data = os.read(file_fh, self.page_size)
+        os.close(file_fh)
+        if not page_data:
+            return 0, 0
+
+        with self.lock:
+            page_id = self._get_warm_page_id(cache_index, path, page_index)
+            if page_id is None or storage_write_count != self.storage_write_count:
+                return len(page_data), 0
+
+            page_fh = os.open(os.path.join(self.cache_dir, page_id), os.O_CREAT|os.O_WRONLY)
+            os.write(page_fh, page_data)
+            os.close(page_fh)
+
+            cache_req = Req(page_id, self.page_size, 0, path)
+            self.cache_list[cache_index]._insert(cache_req)
+        return len(page_data), len(page_data)
+
+    def export_hot_pages(self):
+        """ Get the pages in cache, most recently used first. 
+
+            :return: a list of (path, page_index) tuples """
+        hot_page_list = []
+        with self.lock:
+            for cache in self.cache_list:
+                for cache_req in reversed(list(cache.cacheline_dict.values())):
+                    hot_page_list.append((cache_req.path, int(cache_req.item_id.split("_")[1])))
+        return hot_page_list
+
+    def _read(self, path, length, offset, fh):      
         bytes_read = bytes()
+        # the monitor thread shrinks the caches outside the I/O path once it is started 
+        if self.mem_monitor_thread is None:
+            self._check_mem_pressure()
 
         # check if the any directory in the path is in the ignore list  
         for ignore_dir in self.ignore_dir_list:
@@ -119,13 +402,7 @@ class KubeCache:
                 os.lseek(fh, offset, os.SEEK_SET)
                 return os.read(fh, length)
 
-        cache_index = None 
-        for cur_cache_index, cache in enumerate(self.cache_config_list):
-            if cache["dir"] == "*" and cache_index is None:
-                cache_index = cur_cache_index
-            elif cache["dir"] in path:
-                cache_index = cur_cache_index
-        
+        cache_index = self._get_cache_index(path)
         if cache_index is None:
             os.lseek(fh, offset, os.SEEK_SET)
             return os.read(fh, length)
@@ -136,15 +413,24 @@ class KubeCache:
             page_id = self._get_page_id(path, page_index)
             page_path = os.path.join(self.cache_dir, page_id)
 
-            if os.path.isfile(page_path):
+            page_data = self.hot_cache.get(page_id) if self.hot_cache is not None else None
+            if page_data is not None:
+                # hot page, served from memory without touching the page file 
+                self.cache_list[cache_index]._update(page_id)
+                self._record(cache_index, "read_hits")
+            elif os.path.isfile(page_path):
                 self.cache_list[cache_index]._update(page_id)
+                self._record(cache_index, "read_hits")
                 page_data = self._read_page(page_path)
+                if self.hot_cache is not None:
+                    self.hot_cache.put(page_id, page_data)
             else:
-                if len(self.cache_list[cache_index]) == self.cache_config_list[cache_index]["size"]:
+                if len(self.cache_list[cache_index]) >= self.cache_capacity_list[cache_index]:
                     self._evict(cache_index)
                 
                 cache_req = Req(page_id, self.page_size, 0, path)
                 self.cache_list[cache_index]._insert(cache_req)
+                self._record(cache_index, "read_misses")
 
                 # read the page from file 
                 os.lseek(fh, page_start_offset, os.SEEK_SET)
@@ -155,6 +441,9 @@ class KubeCache:
                 os.write(page_fh, page_data)
                 os.close(page_fh)
 
+                if self.hot_cache is not None:
+                    self.hot_cache.put(page_id, page_data)
+
             # Decide what bytes of the page need to be returned 
             # Case 1: This is the first and last page. 
             if page_index==0 and len(page_array)==1:
@@ -173,7 +462,11 @@ class KubeCache:
         os.lseek(fh, offset+length, os.SEEK_SET)
         return bytes_read
 
-    def write(self, path, buf, offset, fh):
+    def _write(self, path, buf, offset, fh):
+        self.storage_write_count += 1
+        # the monitor thread shrinks the caches outside the I/O path once it is started 
+        if self.mem_monitor_thread is None:
+            self._check_mem_pressure()
 
         # check if the any directory in the path is in the ignore list  
         for ignore_dir in self.ignore_dir_list:
@@ -181,17 +474,23 @@ class KubeCache:
                 os.lseek(fh, offset, os.SEEK_SET)
                 return os.write(fh, buf)
 
-        cache_index = None 
-        for cur_cache_index, cache in enumerate(self.cache_config_list):
-            if cache["dir"] == "*" and cache_index is None:
-                cache_index = cur_cache_index
-            elif cache["dir"] in path:
-                cache_index = cur_cache_index
-        
+        cache_index = self._get_cache_index(path)
         if cache_index is None:
             os.lseek(fh, offset, os.SEEK_SET)
             return os.write(fh, buf)
 
+        write_policy = self.write_policy_list[cache_index]
+        if write_policy == WritePolicy.WRITE_AROUND:
+            return self._write_around(cache_index, path, buf, offset, fh)
+
+        # write-through persists the data first and only caches what reached storage 
+        if write_policy == WritePolicy.WRITE_THROUGH:
+            os.lseek(fh, offset, os.SEEK_SET)
+            bytes_persisted = os.write(fh, buf)
+            if bytes_persisted == 0:
+                return 0
+            buf = buf[:bytes_persisted]
+
         cur_buf_index = 0
         bytes_written = 0 
         write_len = len(buf)
@@ -223,17 +522,24 @@ class KubeCache:
 
             if os.path.isfile(page_path):
                 self.cache_list[cache_index]._update(page_id)
+                self._record(cache_index, "write_hits")
                 cur_req = self.cache_list[cache_index].cacheline_dict[page_id]
-                new_req = Req(cur_req.item_id, self.page_size, 1, path)
+                # with write-through the page only stays dirty if it was dirty before this write 
+                op = cur_req.op if write_policy == WritePolicy.WRITE_THROUGH else 1
+                new_req = Req(cur_req.item_id, self.page_size, op, path)
                 self.cache_list[cache_index].cacheline_dict[page_id] = new_req
                 self._update_page(page_path, page_start_offset, offset, buf[cur_buf_index:cur_buf_index+len_write_data])
+                if self.hot_cache is not None:
+                    self.hot_cache.update(page_id, max(offset-page_start_offset, 0), buf[cur_buf_index:cur_buf_index+len_write_data])
                 cur_buf_index += len_write_data
             else:
-                if len(self.cache_list[cache_index]) == self.cache_config_list[cache_index]["size"]:
+                if len(self.cache_list[cache_index]) >= self.cache_capacity_list[cache_index]:
                     self._evict(cache_index)
 
-                cache_req = Req(page_id, self.page_size, 1, path)
+                op = 0 if write_policy == WritePolicy.WRITE_THROUGH else 1
+                cache_req = Req(page_id, self.page_size, op, path)
                 self.cache_list[cache_index]._insert(cache_req)
+                self._record(cache_index, "write_misses")
 
                 # if page aligned, just write to cache 
                 if page_start_offset==offset and len_write_data==self.page_size:
@@ -261,6 +567,30 @@ class KubeCache:
         os.lseek(fh, offset+len(buf), os.SEEK_SET)
         return bytes_written
 
+    def _write_around(self, cache_index, path, buf, offset, fh):
+        """ Write straight to persistent storage and invalidate the cached pages 
+            it overlaps so that they are fetched again on the next read. 
+
+            :param cache_index: the index of the cache handling the path 
+            :param path: the path of the file being written 
+            :param buf: bytes to be written 
+            :param offset: the offset at which the write begins 
+            :param fh: the file handle of the file being written 
+
+            :return: the number of bytes written """
+
+        # dirty pages are written back before the new data so they do not overwrite it 
+        for page_index, page_start_offset in self._get_pages(offset, len(buf)):
+            page_id = self._get_page_id(path, page_index)
+            if page_id in self.cache_list[cache_index].cacheline_dict:
+                self._record(cache_index, "write_hits")
+                self._invalidate_page(cache_index, page_id)
+            else:
+                self._record(cache_index, "write_misses")
+
+        os.lseek(fh, offset, os.SEEK_SET)
+        return os.write(fh, buf)
+
     @staticmethod 
     def get_config_from_file(config_file):
         config = {}
@@ -295,8 +625,23 @@ class KubeCache:
             raise ValueError("The path entered for cache configuration file does not exist or is not a file.")
         return config, cache 
 
+    def get_stats(self):
+        """ Get the hits, misses and write-backs per write policy along with the hit 
+            rate of the hot page cache. 
+
+            :return stats: a dict that can be dumped as JSON """
+        with self.lock:
+            stats = {"write_policy": {write_policy: dict(policy_stats) for write_policy, policy_stats in self.stats.items()}}
+            if self.hot_cache is not None:
+                stats["hot_cache"] = {
+                    "hits": self.hot_cache.hits,
+                    "misses": self.hot_cache.misses,
+                    "hit_rate": self.hot_cache.hit_rate()
+                }
+        return stats 
+
     def __repr__(self):
-        pass 
+        return "KubeCache(cache_dir={}, page_size={}, caches={})".format(self.cache_dir, self.page_size, len(self.cache_list))
 
     def __str__(self):
-        pass         
\ No newline at end of file
+        return json.dumps(self.get_stats())
@@ -5,10 +5,13 @@ from __future__ import with_statement
 import os
 import sys
 import errno
+import signal
+import threading
 import argparse
 import math 
 import hashlib 
 import json 
+import logging
 import numpy as np
 
 from fuse import FUSE, FuseOSError, Operations
@@ -16,14 +19,27 @@ from PyMimircache.cache.lru import LRU
 from PyMimircache.cacheReader.requestItem import Req
 
 from KubeCache import KubeCache 
+from CacheWarmer import CacheWarmer
+
+logger = logging.getLogger(__name__)
 
 class KubeCacheFS(Operations):
     """ KubeCacheFS is a FS that has highly customizable I/O cache """
 
-    def __init__(self, storage_path, cache_path, config_file):
+    def __init__(self, storage_path, cache_path, config_file, warm_file=None, snapshot_file=None):
         self.root = storage_path 
         self.cache_path = cache_path 
-        self.kubecache = KubeCache(KubeCacheFS._get_config_from_file(config_file))
+        config = KubeCacheFS._get_config_from_file(config_file)
+        self.kubecache = KubeCache(config)
+
+        # pages listed in warm_file are loaded in the background at mount, the hot pages 
+        # are saved to snapshot_file so that a later mount can be warmed from it 
+        self.prewarm_config = config["prewarm"] if "prewarm" in config else {}
+        self.warm_file = warm_file
+        self.snapshot_file = snapshot_file
+        self.cache_warmer = None
+        self.snapshot_thread = None 
+        self.snapshot_stop_event = threading.Event()
 
     @staticmethod
     def _get_config_from_file(config_file):
@@ -45,6 +61,69 @@ class KubeCacheFS(Operations):
             partial = partial[1:]
         return os.path.join(self.root, partial)
 
+    def save_hot_pages(self, snapshot_file=None):
+        """ Save the pages currently in cache in the format read from the warm file. 
+
+            :param snapshot_file: the file to save to, defaults to the snapshot file of the FS 
+        """
+
+        snapshot_file = snapshot_file if snapshot_file is not None else self.snapshot_file
+        if snapshot_file is None:
+            return 
+
+        manifest = CacheWarmer.get_manifest_from_hot_pages(self.kubecache.export_hot_pages(), self.root)
+        CacheWarmer.save_manifest(manifest, snapshot_file)
+
+    def _run_snapshot_saver(self):
+        while True:
+            signal.sigwait({signal.SIGUSR1})
+            if self.snapshot_stop_event.is_set():
+                return 
+
+            try:
+                self.save_hot_pages()
+            except OSError as e:
+                logger.warning("Cannot save hot pages to %s: %s", self.snapshot_file, e)
+
+    # Mount and unmount 
+    # =================
+    def init(self, path):
+        if self.snapshot_file is not None:
+            # SIGUSR1 saves the hot pages of the running instance. It is blocked in every thread 
+            # and taken with sigwait on its own thread because a Python handler only runs on the 
+            # main thread, which sits in fuse_main until the next FUSE callback. 
+            signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGUSR1})
+            self.snapshot_thread = threading.Thread(target=self._run_snapshot_saver, daemon=True)
+            self.snapshot_thread.start()
+
+        self.kubecache.start_mem_monitor()
+        if self.warm_file is None:
+            return 
+
+        # a missing or broken manifest, e.g. no snapshot yet on first boot, mounts without warming 
+        manifest = CacheWarmer.load_manifest(self.warm_file)
+        if manifest is None:
+            return 
+
+        try:
+            page_list = CacheWarmer.get_page_list_from_manifest(manifest, self.root, self.kubecache.page_size)
+        except (KeyError, TypeError, ValueError) as e:
+            logger.warning("Not warming the cache, malformed manifest %s: %s", self.warm_file, e)
+            return 
+        self.cache_warmer = CacheWarmer(self.kubecache, page_list, self.prewarm_config)
+        self.cache_warmer.start()
+
+    def destroy(self, path):
+        if self.snapshot_thread is not None:
+            self.snapshot_stop_event.set()
+            signal.pthread_kill(self.snapshot_thread.ident, signal.SIGUSR1)
+            self.snapshot_thread.join()
+        self.kubecache.stop_mem_monitor()
+        if self.cache_warmer is not None:
+            self.cache_warmer.stop()
+        self.save_hot_pages()
+        logger.info("KubeCache stats: %s", self.kubecache)
+
 
     # Filesystem methods
     # ==================
@@ -148,8 +227,8 @@ class KubeCacheFS(Operations):
     def fsync(self, path, fdatasync, fh):
         return self.flush(path, fh)
 
-def main(mountpoint, root, cache_path, cache_config_file):
-    FUSE(KubeCacheFS(root, cache_path, cache_config_file), 
+def main(mountpoint, root, cache_path, cache_config_file, warm_file=None, snapshot_file=None):
+    FUSE(KubeCacheFS(root, cache_path, cache_config_file, warm_file, snapshot_file), 
         mountpoint, 
         nothreads=True, 
         foreground=True, 
@@ -165,6 +244,11 @@ if __name__ == '__main__':
         help="The directory used as a cache on a faster storage device.")
     parser.add_argument("-k", "--kcacheconfig",
         help="The configuration file for KubeCache.")
+    parser.add_argument("-w", "--warm",
+        help="A manifest of files, ranges or pages to load into cache in the background at mount.")
+    parser.add_argument("-p", "--snapshot",
+        help="The file the hot pages are saved to on SIGUSR1 and unmount, usable as a manifest.")
     args = parser.parse_args()
 
-    main(args.mountpoint, args.storage, args.cache, args.kcacheconfig)
+    logging.basicConfig(level=logging.INFO)
+    main(args.mountpoint, args.storage, args.cache, args.kcacheconfig, args.warm, args.snapshot)
@@ -0,0 +1,107 @@
+import os
+import time
+
+class MemPressureMonitor:
+    """ MemPressureMonitor reads cgroup v2 memory files to tell KubeCache when the node is under memory pressure """
+
+    def __init__(self, config):
+        cgroup_dir = config["cgroup_dir"] if "cgroup_dir" in config else "/sys/fs/cgroup"
+        self.memory_current_path = config["memory_current"] if "memory_current" in config else os.path.join(cgroup_dir, "memory.current")
+        self.memory_max_path = config["memory_max"] if "memory_max" in config else os.path.join(cgroup_dir, "memory.max")
+        self.memory_pressure_path = config["memory_pressure"] if "memory_pressure" in config else os.path.join(cgroup_dir, "memory.pressure")
+
+        # pressure if memory.current/memory.max or the "some avg10" PSI value reach these thresholds
+        self.usage_threshold = config["usage_threshold"] if "usage_threshold" in config else 0.9
+        self.psi_threshold = config["psi_threshold"] if "psi_threshold" in config else 10.0
+
+        # seconds between two reads of the cgroup files
+        self.interval = config["interval"] if "interval" in config else 1.0
+
+        # fraction of the capacity removed on each poll under pressure and added back once it clears
+        self.shrink_step = config["shrink_step"] if "shrink_step" in config else 0.1
+        self.grow_step = config["grow_step"] if "grow_step" in config else 0.02
+
+        # fraction of the configured size a partition can never shrink below
+        self.min_fraction = config["min_fraction"] if "min_fraction" in config else 0.1
+
+        self.last_poll_time = None
+
+    @staticmethod
+    def _read_file(file_path):
+        """ Read a cgroup file.
+
+            :param file_path: the path of the file
+
+            :return: the stripped content of the file or None if it cannot be read """
+
+        try:
+            with open(file_path) as f:
+                return f.read().strip()
+        except OSError:
+            return None
+
+    def get_memory_usage(self):
+        """ Get the fraction of the cgroup memory limit that is in use.
+
+            :return: memory.current/memory.max or None if there is no limit """
+
+        memory_current = MemPressureMonitor._read_file(self.memory_current_path)
+        memory_max = MemPressureMonitor._read_file(self.memory_max_path)
+        if memory_current is None or memory_max is None or memory_max == "max":
+            return None
+        try:
+            memory_current = int(memory_current)
+            memory_max = int(memory_max)
+        except ValueError:
+            return None
+        if memory_max == 0:
+            return None
+        return memory_current/memory_max
+
+    def get_memory_pressure(self):
+        """ Get the PSI share of time in the last 10 seconds where some tasks stalled on memory.
+
+            :return: the "some avg10" value of memory.pressure or None if it is not available """
+
+        memory_pressure = MemPressureMonitor._read_file(self.memory_pressure_path)
+        if memory_pressure is None:
+            return None
+
+        for line in memory_pressure.splitlines():
+            fields = line.split()
+            if not fields or fields[0] != "some":
+                continue
+            for field in fields[1:]:
+                key, _, value = field.partition("=")
+                if key == "avg10":
+                    try:
+                        return float(value)
+                    except ValueError:
+                        return None
+        return None
+
+    def is_under_pressure(self):
+        """ Check if either the memory usage or the PSI value crossed its threshold.
+
+            :return: True if the cache should shrink """
+
+        memory_usage = self.get_memory_usage()
+        if memory_usage is not None and memory_usage >= self.usage_threshold:
+            return True
+
+        memory_pressure = self.get_memory_pressure()
+        if memory_pressure is not None and memory_pressure >= self.psi_threshold:
+            return True
+
+        return False
+
+    def poll(self):
+        """ Check for memory pressure at most once every interval.
+
+            :return: None if the interval has not passed yet, otherwise the result of is_under_pressure """
+
+        cur_time = time.monotonic()
+        if self.last_poll_time is not None and cur_time-self.last_poll_time < self.interval:
+            return None
+        self.last_poll_time = cur_time
+        return self.is_under_pressure()
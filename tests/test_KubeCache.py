@@ -1,10 +1,13 @@
 import unittest
-import os, shutil, sys 
+import os, shutil, sys, time 
 sys.path.insert(1, '../KubeCacheFS')
 sys.path.insert(2, '../../PyMimircache')
 
 from PyMimircache.cache.lru import LRU
 from KubeCache import KubeCache
+from MemPressureMonitor import MemPressureMonitor
+from HotPageCache import HotPageCache
+from CacheWarmer import CacheWarmer
 
 CACHE_DIR = "./cache"
 STORAGE_DIR = "./storage"
@@ -57,6 +60,16 @@ def create_dir_and_fill_with_files(dir_path, file_array):
         create_file(filepath, size_mb)
 
 
+def write_mem_files(memory_current, memory_max, psi_avg10):
+    with open(os.path.join(STORAGE_DIR, "memory.current"), "w+") as f:
+        f.write("{}\n".format(memory_current))
+    with open(os.path.join(STORAGE_DIR, "memory.max"), "w+") as f:
+        f.write("{}\n".format(memory_max))
+    with open(os.path.join(STORAGE_DIR, "memory.pressure"), "w+") as f:
+        f.write("some avg10={:.2f} avg60=0.00 avg300=0.00 total=0\n".format(psi_avg10))
+        f.write("full avg10=0.00 avg60=0.00 avg300=0.00 total=0\n")
+
+
 def read_file(kcache, path, offset, length):
     fh = os.open(path, os.O_RDWR)
     read_bytes = kcache.read(path, length, offset, fh)
@@ -216,6 +229,395 @@ class TestKubeCache(unittest.TestCase):
         self.assertEqual(kcache.cache_dir, CACHE_DIR)
         clean_folders()
 
+    def test_mem_pressure_monitor(self):
+        setup_folders()
+        monitor = MemPressureMonitor({
+            "cgroup_dir": STORAGE_DIR,
+            "usage_threshold": 0.9,
+            "psi_threshold": 10.0
+        })
+
+        write_mem_files(50, "max", 0.0)
+        self.assertIsNone(monitor.get_memory_usage())
+        self.assertFalse(monitor.is_under_pressure())
+
+        write_mem_files(95, 100, 0.0)
+        self.assertEqual(monitor.get_memory_usage(), 0.95)
+        self.assertTrue(monitor.is_under_pressure())
+
+        write_mem_files(50, 100, 25.5)
+        self.assertEqual(monitor.get_memory_pressure(), 25.5)
+        self.assertTrue(monitor.is_under_pressure())
+
+        # malformed cgroup files are ignored 
+        write_mem_files("garbage", 100, 0.0)
+        self.assertIsNone(monitor.get_memory_usage())
+        self.assertFalse(monitor.is_under_pressure())
+
+        # missing cgroup files are never treated as pressure 
+        monitor = MemPressureMonitor({"cgroup_dir": os.path.join(STORAGE_DIR, "none")})
+        self.assertFalse(monitor.is_under_pressure())
+        clean_folders()
+
+    def test_mem_pressure_shrink_and_grow(self):
+        setup_folders()
+
+        data_file_path = os.path.join(STORAGE_DIR, "data_file")
+        create_file(data_file_path, 1)
+
+        page_size = 4096
+        cache_size = 10
+        cache_config = {
+            "cache_dir": CACHE_DIR,
+            "page_size": page_size,
+            "mem_pressure": {
+                "cgroup_dir": STORAGE_DIR,
+                "interval": 0,
+                "shrink_step": 0.5,
+                "grow_step": 0.2
+            },
+            "caches": [{
+                "replacement_policy": "LRU",
+                "size": cache_size,
+                "dir": "*"
+            }]}
+        write_mem_files(50, 100, 0.0)
+        kcache = KubeCache(cache_config)
+
+        # 8 clean pages and 2 dirty pages 
+        fh = os.open(data_file_path, os.O_RDWR)
+        kcache.read(data_file_path, 8*page_size, 0, fh)
+        byte_array = bytearray("string-inserting", 'utf-8')
+        kcache.write(data_file_path, byte_array, 8*page_size, fh)
+        kcache.write(data_file_path, byte_array, 9*page_size, fh)
+        self.assertEqual(len(os.listdir(CACHE_DIR)), 10)
+
+        # without the monitor thread the monitor is polled from read and write 
+        self.assertIsNone(kcache.mem_monitor_thread)
+
+        # under pressure the capacity is halved and only clean pages are dropped 
+        write_mem_files(95, 100, 0.0)
+        kcache.read(data_file_path, 10, 0, fh)
+        self.assertEqual(kcache.cache_capacity_list[0], 5)
+        self.assertEqual(len(os.listdir(CACHE_DIR)), 5)
+        dirty_list = [req for req in kcache.cache_list[0].cacheline_dict.values() if req.op == 1]
+        self.assertEqual(len(dirty_list), 2)
+
+        # dirty pages are written back before they are evicted 
+        kcache.read(data_file_path, 10, 0, fh)
+        kcache.read(data_file_path, 10, 0, fh)
+        self.assertEqual(kcache.cache_capacity_list[0], 1)
+        self.assertEqual(len(os.listdir(CACHE_DIR)), 1)
+        os.lseek(fh, 9*page_size, os.SEEK_SET)
+        self.assertEqual(os.read(fh, len(byte_array)), byte_array)
+
+        # capacity comes back a step at a time once the pressure clears 
+        write_mem_files(50, 100, 0.0)
+        kcache.read(data_file_path, 10, 0, fh)
+        self.assertEqual(kcache.cache_capacity_list[0], 3)
+        kcache.read(data_file_path, 10, 0, fh)
+        self.assertEqual(kcache.cache_capacity_list[0], 5)
+
+        os.close(fh)
+        clean_folders()
+
+    def test_mem_monitor_thread(self):
+        setup_folders()
+
+        data_file_path = os.path.join(STORAGE_DIR, "data_file")
+        create_file(data_file_path, 1)
+
+        page_size = 4096
+        cache_config = {
+            "cache_dir": CACHE_DIR,
+            "page_size": page_size,
+            "mem_pressure": {
+                "cgroup_dir": STORAGE_DIR,
+                "interval": 0.01,
+                "shrink_step": 0.5
+            },
+            "caches": [{
+                "replacement_policy": "LRU",
+                "size": 10,
+                "dir": "*"
+            }]}
+        write_mem_files(50, 100, 0.0)
+        kcache = KubeCache(cache_config)
+
+        fh = os.open(data_file_path, os.O_RDWR)
+        kcache.read(data_file_path, 10*page_size, 0, fh)
+        os.close(fh)
+        self.assertEqual(len(os.listdir(CACHE_DIR)), 10)
+
+        # the cache shrinks under pressure even without any I/O 
+        write_mem_files(95, 100, 0.0)
+        kcache.start_mem_monitor()
+        time.sleep(0.5)
+        kcache.stop_mem_monitor()
+        self.assertEqual(kcache.cache_capacity_list[0], 1)
+        self.assertEqual(len(os.listdir(CACHE_DIR)), 1)
+
+        # once the thread is started foreground I/O never shrinks the caches itself 
+        check_cache_dir_and_empty_it(CACHE_DIR)
+        cache_config["mem_pressure"]["interval"] = 60
+        kcache = KubeCache(cache_config)
+        write_mem_files(50, 100, 0.0)
+        fh = os.open(data_file_path, os.O_RDWR)
+        kcache.read(data_file_path, 10*page_size, 0, fh)
+        write_mem_files(95, 100, 0.0)
+        kcache.start_mem_monitor()
+        kcache.read(data_file_path, 10, 0, fh)
+        kcache.stop_mem_monitor()
+        os.close(fh)
+        self.assertEqual(kcache.cache_capacity_list[0], 10)
+        clean_folders()
+
+    def test_hot_page_cache(self):
+        hot_cache = HotPageCache(2, 8)
+        hot_cache.put("a_0", b"aaaaaaaa")
+        hot_cache.put("b_0", b"bbbb")
+        self.assertEqual(hot_cache.get("a_0"), b"aaaaaaaa")
+
+        # b_0 is the least recently used page so it makes room for c_0 
+        hot_cache.put("c_0", b"cccccccc")
+        self.assertIsNone(hot_cache.get("b_0"))
+        self.assertEqual(hot_cache.get("c_0"), b"cccccccc")
+
+        hot_cache.update("a_0", 2, b"xy")
+        self.assertEqual(hot_cache.get("a_0"), b"aaxyaaaa")
+
+        hot_cache.invalidate("a_0")
+        self.assertIsNone(hot_cache.get("a_0"))
+        self.assertEqual(len(hot_cache), 1)
+        self.assertEqual(hot_cache.hit_rate(), 0.6)
+
+    def test_hot_page_cache_coherent_with_writes(self):
+        setup_folders()
+
+        data_file_path = os.path.join(STORAGE_DIR, "data_file")
+        create_file(data_file_path, 1)
+
+        page_size = 4096
+        cache_config = {
+            "cache_dir": CACHE_DIR,
+            "page_size": page_size,
+            "hot_cache_size": 2,
+            "caches": [{
+                "replacement_policy": "LRU",
+                "size": 2,
+                "dir": "*"
+            }]}
+        kcache = KubeCache(cache_config)
+
+        fh = os.open(data_file_path, os.O_RDWR)
+        self.assertEqual(kcache.read(data_file_path, 10, 0, fh), b"abcdefghij")
+        self.assertEqual(kcache.read(data_file_path, 10, 0, fh), b"abcdefghij")
+        self.assertEqual(kcache.hot_cache.hits, 1)
+
+        string = "string-inserting"
+        byte_array = bytearray(string, 'utf-8')
+        kcache.write(data_file_path, byte_array, 2, fh)
+        self.assertEqual(kcache.read(data_file_path, len(string), 2, fh), byte_array)
+        self.assertEqual(kcache.hot_cache.hits, 2)
+
+        # evicting the page from the tmpfs cache removes it from the hot cache as well 
+        kcache.read(data_file_path, 10, page_size, fh)
+        kcache.read(data_file_path, 10, 2*page_size, fh)
+        self.assertEqual(len(os.listdir(CACHE_DIR)), 2)
+        self.assertEqual(len(kcache.hot_cache), 2)
+        self.assertIsNone(kcache.hot_cache.get(kcache._get_page_id(data_file_path, 0)))
+
+        stats = kcache.get_stats()
+        self.assertEqual(stats["hot_cache"]["hits"], kcache.hot_cache.hits)
+        self.assertEqual(stats["hot_cache"]["hit_rate"], kcache.hot_cache.hit_rate())
+        self.assertIn("hit_rate", str(kcache))
+        os.close(fh)
+
+        # a write past the end of a short page leaves zeros in the hot cache, not the 
+        # data of the page that used the slot before 
+        kcache = KubeCache(dict(cache_config, hot_cache_size=1))
+        full_file_path = os.path.join(STORAGE_DIR, "full_file")
+        small_file_path = os.path.join(STORAGE_DIR, "small_file")
+        with open(full_file_path, "w+") as f:
+            f.write("S"*page_size)
+        with open(small_file_path, "w+") as f:
+            f.write("a"*100)
+
+        fh = os.open(full_file_path, os.O_RDWR)
+        kcache.read(full_file_path, page_size, 0, fh)
+        os.close(fh)
+
+        fh = os.open(small_file_path, os.O_RDWR)
+        kcache.read(small_file_path, 100, 0, fh)
+        kcache.write(small_file_path, b"zz", 200, fh)
+        self.assertEqual(kcache.read(small_file_path, 202, 0, fh), b"a"*100 + bytes(100) + b"zz")
+        self.assertEqual(kcache.hot_cache.get(kcache._get_page_id(small_file_path, 0)), 
+            kcache._read_page(os.path.join(CACHE_DIR, kcache._get_page_id(small_file_path, 0))))
+        os.close(fh)
+
+        clean_folders()
+
+    def test_write_policy(self):
+        setup_folders()
+
+        page_size = 4096
+        cache_config = {
+            "cache_dir": CACHE_DIR,
+            "page_size": page_size,
+            "caches": [{
+                "replacement_policy": "LRU",
+                "size": 2,
+                "dir": "through",
+                "write_policy": "write-through"
+            }, {
+                "replacement_policy": "LRU",
+                "size": 2,
+                "dir": "around",
+                "write_policy": "write-around"
+            }]}
+        kcache = KubeCache(cache_config)
+
+        through_dir_path = os.path.join(STORAGE_DIR, "through")
+        around_dir_path = os.path.join(STORAGE_DIR, "around")
+        create_dir_and_fill_with_files(through_dir_path, [["file1", 1]])
+        create_dir_and_fill_with_files(around_dir_path, [["file1", 1]])
+
+        string = "string-inserting"
+        byte_array = bytearray(string, 'utf-8')
+
+        # write-through caches the page clean and persists the data right away 
+        through_file_path = os.path.join(through_dir_path, "file1")
+        fh = os.open(through_file_path, os.O_RDWR)
+        bytes_written = kcache.write(through_file_path, byte_array, 10, fh)
+        self.assertEqual(bytes_written, len(string))
+        self.assertEqual(len(os.listdir(CACHE_DIR)), 1)
+        self.assertEqual(kcache.cache_list[0].cacheline_dict[kcache._get_page_id(through_file_path, 0)].op, 0)
+        os.lseek(fh, 10, os.SEEK_SET)
+        self.assertEqual(os.read(fh, len(string)), byte_array)
+        self.assertEqual(kcache.read(through_file_path, len(string), 10, fh), byte_array)
+        os.close(fh)
+
+        # a failed storage write leaves the cache untouched 
+        fh = os.open(through_file_path, os.O_RDONLY)
+        with self.assertRaises(OSError):
+            kcache.write(through_file_path, bytearray("ZZZZ", 'utf-8'), 10, fh)
+        self.assertEqual(kcache.read(through_file_path, len(string), 10, fh), byte_array)
+        os.close(fh)
+
+        # write-around skips the cache and invalidates the page it overlaps 
+        around_file_path = os.path.join(around_dir_path, "file1")
+        fh = os.open(around_file_path, os.O_RDWR)
+        kcache.read(around_file_path, 10, 0, fh)
+        self.assertEqual(len(os.listdir(CACHE_DIR)), 2)
+        bytes_written = kcache.write(around_file_path, byte_array, 10, fh)
+        self.assertEqual(bytes_written, len(string))
+        self.assertEqual(len(os.listdir(CACHE_DIR)), 1)
+        kcache.write(around_file_path, byte_array, page_size, fh)
+        self.assertEqual(len(os.listdir(CACHE_DIR)), 1)
+        self.assertEqual(kcache.read(around_file_path, len(string), 10, fh), byte_array)
+        os.close(fh)
+
+        self.assertEqual(kcache.stats["write-through"]["write_misses"], 1)
+        self.assertEqual(kcache.stats["write-through"]["read_hits"], 2)
+        self.assertEqual(kcache.stats["write-around"]["write_hits"], 1)
+        self.assertEqual(kcache.stats["write-around"]["write_misses"], 1)
+        self.assertEqual(kcache.stats["write-around"]["read_misses"], 2)
+        self.assertEqual(kcache.stats["write-back"]["write_misses"], 0)
+        clean_folders()
+
+    def test_cache_warmer(self):
+        setup_folders()
+
+        data_file_path = os.path.join(STORAGE_DIR, "data_file")
+        create_file(data_file_path, 1)
+
+        page_size = 4096
+        cache_size = 4
+        cache_config = {
+            "cache_dir": CACHE_DIR,
+            "page_size": page_size,
+            "caches": [{
+                "replacement_policy": "LRU",
+                "size": cache_size,
+                "dir": "*"
+            }]}
+        kcache = KubeCache(cache_config)
+
+        fh = os.open(data_file_path, os.O_RDWR)
+        kcache.read(data_file_path, 10, 0, fh)
+        self.assertTrue(kcache.is_foreground_busy(60))
+        self.assertFalse(kcache.is_foreground_busy(0))
+
+        # page 0 is already cached and warming never evicts, so only 3 more pages are loaded 
+        page_list = [(data_file_path, page_index) for page_index in range(6)]
+        cache_warmer = CacheWarmer(kcache, page_list, {
+            "concurrency": 2,
+            "bandwidth_mb": 100,
+            "idle_ms": 0
+        })
+        cache_warmer.start()
+        cache_warmer.join()
+        self.assertEqual(cache_warmer.pages_warmed, 3)
+        self.assertEqual(cache_warmer.bytes_warmed, 3*page_size)
+        self.assertEqual(len(os.listdir(CACHE_DIR)), cache_size)
+
+        # warmed pages are clean and are hits for foreground reads 
+        kcache.read(data_file_path, 10, 0, fh)
+        self.assertEqual(kcache.stats["write-back"]["read_hits"], 1)
+        self.assertTrue(all(req.op == 0 for req in kcache.cache_list[0].cacheline_dict.values()))
+
+        hot_page_list = kcache.export_hot_pages()
+        self.assertEqual(len(hot_page_list), cache_size)
+        self.assertEqual(hot_page_list[0], (data_file_path, 0))
+
+        # pages that are skipped are neither read nor charged to the bandwidth limit 
+        self.assertEqual(kcache.warm_page(data_file_path, 0), (0, 0))
+        page_list = [(data_file_path, page_index) for page_index in range(1000)]
+        cache_warmer = CacheWarmer(kcache, page_list, {"bandwidth_mb": 1})
+        start_time = time.monotonic()
+        cache_warmer.start()
+        cache_warmer.join()
+        self.assertLess(time.monotonic()-start_time, 1)
+        self.assertEqual(cache_warmer.pages_warmed, 0)
+
+        os.close(fh)
+        clean_folders()
+
+    def test_warm_manifest(self):
+        setup_folders()
+
+        page_size = 4096
+        create_dir_and_fill_with_files(os.path.join(STORAGE_DIR, "dir1"), [["file1", 1]])
+        file_path = os.path.join(STORAGE_DIR, "dir1", "file1")
+
+        manifest = {
+            "files": [
+                {"path": "/dir1/file1", "offset": 4095, "length": 2},
+                {"path": "dir1/file1", "offset": 1024*1024-page_size},
+                {"path": "dir1/file1", "offset": 1024*1024},
+                {"path": "dir1/missing"}
+            ],
+            "pages": [{"path": "dir1/file1", "page_index": 7}]
+        }
+        page_list = CacheWarmer.get_page_list_from_manifest(manifest, STORAGE_DIR, page_size)
+        self.assertEqual(page_list, [(file_path, 0), (file_path, 1), (file_path, 255), (file_path, 7)])
+        self.assertEqual(len(CacheWarmer.get_page_list_from_manifest({"files": [{"path": "dir1/file1"}]}, STORAGE_DIR, page_size)), 256)
+
+        # hot pages saved as a manifest load back as the same pages 
+        snapshot_file = os.path.join(STORAGE_DIR, "snapshot.json")
+        hot_page_list = [(file_path, 3), (file_path, 0)]
+        CacheWarmer.save_manifest(CacheWarmer.get_manifest_from_hot_pages(hot_page_list, STORAGE_DIR), snapshot_file)
+        self.assertFalse(os.path.exists("{}.tmp".format(snapshot_file)))
+        manifest = CacheWarmer.load_manifest(snapshot_file)
+        self.assertEqual(CacheWarmer.get_page_list_from_manifest(manifest, STORAGE_DIR, page_size), hot_page_list)
+
+        # a missing or half written snapshot is not an error 
+        self.assertIsNone(CacheWarmer.load_manifest(os.path.join(STORAGE_DIR, "none.json")))
+        with open(snapshot_file, "w+") as f:
+            f.write('{"pages": [{"path"')
+        self.assertIsNone(CacheWarmer.load_manifest(snapshot_file))
+        clean_folders()
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file